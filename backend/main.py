@@ -1,18 +1,25 @@
-import base64
+import asyncio
+import heapq
+import hmac
+import inspect
 import io
-import json
+import logging
+import logging.handlers
 import os
+import queue
 import sqlite3
 import threading
 import time
 import uuid
-from collections import deque
+from contextlib import asynccontextmanager, contextmanager
 from datetime import datetime, timedelta
 from typing import Any, Dict, List, Optional
 
+import httpx
 import numpy as np
+import orjson
 from dotenv import load_dotenv
-from elevenlabs.client import ElevenLabs
+from elevenlabs.client import AsyncElevenLabs
 from fastapi import (
     Body,
     Depends,
@@ -26,21 +33,30 @@ from fastapi import (
 )
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.middleware.gzip import GZipMiddleware
-from fastapi.responses import (
-    Response,
-    StreamingResponse,
-)
+from fastapi.responses import StreamingResponse
 from fastapi.security import OAuth2PasswordBearer
 from fastapi.staticfiles import StaticFiles
 from jose import JWTError, jwt
-from openai import OpenAI
+from openai import AsyncOpenAI
 from passlib.context import CryptContext
-from PIL import Image
+from PIL import Image, ImageOps
 from pydantic import BaseModel, EmailStr, Field
+from turbojpeg import TJPF_BGR, TurboJPEG
 
 # Load environment variables
 load_dotenv()
 
+# Log through a queue so request handlers and the analysis worker never
+# block on writing to stderr; the listener is started in lifespan
+logger = logging.getLogger("roast_bot")
+logger.setLevel(logging.INFO)
+logger.propagate = False
+log_queue = queue.SimpleQueue()
+logger.addHandler(logging.handlers.QueueHandler(log_queue))
+log_handler = logging.StreamHandler()
+log_handler.setFormatter(logging.Formatter("%(levelname)s:     %(message)s"))
+log_listener = logging.handlers.QueueListener(log_queue, log_handler)
+
 # Security configuration
 SECRET_KEY = os.getenv(
     "SECRET_KEY", "YOUR_SECRET_KEY_HERE"
@@ -48,32 +64,107 @@ SECRET_KEY = os.getenv(
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 30
 
+
+class TTLCache:
+    """
+    Bounded cache whose entries expire at a given timestamp
+
+    When full, the oldest entry is evicted to make room for a new one.
+    """
+
+    def __init__(self, max_size: int):
+        self.max_size = max_size
+        self._entries: Dict[Any, tuple] = {}
+
+    def get(self, key):
+        """Get a cached value, or None if it is missing or expired"""
+        cached = self._entries.get(key)
+        if cached is None:
+            return None
+
+        value, expires_at = cached
+        if time.time() < expires_at:
+            return value
+        self._entries.pop(key, None)
+        return None
+
+    def set(self, key, value, expires_at: float):
+        if key not in self._entries and len(self._entries) >= self.max_size:
+            # Evict the oldest entry
+            self._entries.pop(next(iter(self._entries)), None)
+        self._entries[key] = (value, expires_at)
+
+    def pop(self, key):
+        self._entries.pop(key, None)
+
+
+# Verified access tokens mapped to user ids until the token expires
+TOKEN_CACHE_SIZE = 1024
+verified_tokens = TTLCache(TOKEN_CACHE_SIZE)
+
+# Authenticated users by id
+USER_CACHE_SIZE = 4096
+USER_CACHE_TTL_SECONDS = 30
+cached_users = TTLCache(USER_CACHE_SIZE)
+
 # Perplexity AI configuration
 PERPLEXITY_API_KEY = os.getenv("PERPLEXITY_API_KEY")
 
 # API Key for Raspberry Pi integration - in production, use a more secure randomly generated key
 RASPI_API_KEY = os.getenv("RASPI_API_KEY", "raspberry_secret_key")
+RASPI_API_KEY_B = RASPI_API_KEY.encode()
 
 # ElevenLabs API configuration
 ELEVENLABS_API_KEY = os.getenv("ELEVENLABS_API_KEY")
 ELEVENLABS_VOICE_ID = "jsCqWAovK2LkecY7zXl4"  # Default voice ID - could be customized
 
+# Shared HTTP client so upstream TCP/TLS connections are pooled across requests
+http_client = httpx.AsyncClient(
+    limits=httpx.Limits(max_connections=100, max_keepalive_connections=20),
+    timeout=httpx.Timeout(240.0, connect=10.0),
+)
+
 # Initialize ElevenLabs client
-elevenlabs_client = ElevenLabs(api_key=ELEVENLABS_API_KEY)
+elevenlabs_client = AsyncElevenLabs(
+    api_key=ELEVENLABS_API_KEY, httpx_client=http_client
+)
 
 # Initialize OpenAI client for Perplexity
-perplexity_client = OpenAI(
-    api_key=PERPLEXITY_API_KEY, base_url="https://api.perplexity.ai"
+perplexity_client = AsyncOpenAI(
+    api_key=PERPLEXITY_API_KEY,
+    base_url="https://api.perplexity.ai",
+    http_client=http_client,
 )
 
 # Password hashing
 pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 
+# Checked against when an email is unknown so failed logins take the same time
+DUMMY_HASH = pwd_context.hash("dummy-password")
+
 # OAuth2 scheme
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="token")
 
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    log_listener.start()
+    # Initialize database
+    await asyncio.to_thread(init_db)
+    threading.Thread(target=analysis_worker, name="analysis", daemon=True).start()
+    janitor = asyncio.create_task(expire_idle_streams())
+    yield
+    janitor.cancel()
+    stop_analysis_worker()
+    await http_client.aclose()
+    log_listener.stop()
+
+
 # Initialize FastAPI app
-app = FastAPI(title="Roast Bot API")
+app = FastAPI(
+    title="Roast Bot API",
+    lifespan=lifespan,
+)
 
 # Add GZip compression for faster responses
 app.add_middleware(GZipMiddleware, minimum_size=1000)
@@ -100,11 +191,33 @@ os.makedirs(UPLOADS_DIR, exist_ok=True)
 # # Initialize Jinja2 templates
 # templates = Jinja2Templates(directory=TEMPLATES_DIR)
 
+# Serve uploads from the API process unless a reverse proxy handles them
+SERVE_UPLOADS_INLINE = os.getenv("SERVE_UPLOADS_INLINE", "1") == "1"
+
 # Create static files route for uploads
-app.mount("/uploads", StaticFiles(directory=UPLOADS_DIR), name="uploads")
+if SERVE_UPLOADS_INLINE:
+    app.mount("/uploads", StaticFiles(directory=UPLOADS_DIR), name="uploads")
+
+# Profile images are shrunk to fit within this size on upload
+PROFILE_IMAGE_MAX_SIZE = (512, 512)
 
 # Database setup
 DB_PATH = os.path.join(DATA_DIR, "roastbot.db")
+DB_POOL_SIZE = 8
+
+# Number of characteristics fed into each roast prompt
+ROAST_CHARACTERISTIC_COUNT = 5
+
+# Roast prompt pieces, built once and shared by every roast request
+ROAST_SYSTEM_MESSAGE = {
+    "role": "system",
+    "content": "You are a roast bot that generates clever, funny roasts.",
+}
+ROAST_PROMPT_TEMPLATE = """You are the roast god, a vulgar, vial roaster who can be clever but also blunt and cruel. You're not afraid to be politically incorrect and use all the characteristics and context at your disposal. You will be given a name and a list of characteristics and generate a paragraph long roast about them. There is one key detail: RETURN THE ROAST AND NOTHING BUT THE ROAST. There should be no other text besides this one paragraph roasting whoever it is. Now give it a shot:
+
+NAME: {name}
+CHARACTERISTICS:
+{characteristics}"""
 
 # Base URL for serving static files
 BASE_URL = "http://localhost:8000"  # Change this in production
@@ -113,17 +226,377 @@ BASE_URL = "http://localhost:8000"  # Change this in production
 STREAMS_DIR = os.path.join(DATA_DIR, "streams")
 os.makedirs(STREAMS_DIR, exist_ok=True)
 
-# In-memory storage for active video streams
+# SIMD JPEG decoder for incoming camera frames
+jpeg_decoder = TurboJPEG()
+
+# PyTurboJPEG 1.8+ can decode into an existing array, which lets each stream
+# reuse one frame buffer instead of allocating a new one per frame
+DECODE_INTO_BUFFER = "dst" in inspect.signature(TurboJPEG.decode).parameters
+frame_buffers = {}
+
+# Frames waiting for analysis, holding only the newest frame of each stream.
+# A single worker thread analyzes them in batches so it never holds up a
+# request and the model runs once per batch rather than once per frame.
+ANALYSIS_BATCH_SIZE = 16
+ANALYSIS_BATCH_WINDOW_SECONDS = 0.05
+pending_analysis = {}
+analysis_ready = threading.Condition()
+analysis_stopping = threading.Event()
+
+# Optional ONNX export of the DeepFace emotion model, see README
+EMOTION_ONNX_MODEL = os.getenv("EMOTION_ONNX_MODEL")
+EMOTION_LABELS = ("angry", "disgust", "fear", "happy", "sad", "surprise", "neutral")
+EMOTION_INPUT_SIZE = (48, 48)
+ONNX_PROVIDERS = (
+    "TensorrtExecutionProvider",
+    "CUDAExecutionProvider",
+    "CPUExecutionProvider",
+)
+emotion_session = None
+face_detector = None
+
+# In-memory storage for active video streams. Streams are only added on the
+# event loop; the analysis worker just replaces an existing stream's
+# "analysis" entry, a single dict assignment, so no lock is needed
 active_streams = {}
 stream_frames = {}
-stream_lock = threading.Lock()
 
+# Resend the latest frame this often when the producer goes quiet
+STREAM_KEEPALIVE_SECONDS = 5.0
+
+# Streams that send no frames for this long are dropped
+STREAM_TIMEOUT_SECONDS = 30
+STREAM_JANITOR_INTERVAL_SECONDS = 10
+
+# (deadline, stream_id) pairs, one per active stream, soonest deadline first
+expiry_heap = []
+
+
+class FrameBroadcaster:
+    """
+    Hands the latest frame of a stream to every connected viewer
+
+    Viewers wait on the stream's own condition, which the producer notifies
+    when a new frame arrives, so viewers sleep until there is something to
+    send. A viewer that falls behind only ever sees the newest frame.
+    """
+
+    def __init__(self):
+        self.latest_frame = None
+        self.frame_number = 0
+        self.viewers = 0
+        self._new_frame = asyncio.Condition()
+
+    async def publish(self, frame):
+        async with self._new_frame:
+            self.latest_frame = frame
+            self.frame_number += 1
+            self._new_frame.notify_all()
+
+    async def wait_for_frame(self, last_seen, timeout):
+        """
+        Wait for a frame newer than `last_seen`
+
+        Returns:
+            int: Number of the current frame, unchanged if the wait timed out
+        """
+        async with self._new_frame:
+            try:
+                await asyncio.wait_for(
+                    self._new_frame.wait_for(lambda: self.frame_number != last_seen),
+                    timeout,
+                )
+            except asyncio.TimeoutError:
+                pass
+            return self.frame_number
+
+
+def get_frame_broadcaster(stream_id):
+    """Get the frame broadcaster for a stream, creating it if needed"""
+    broadcaster = stream_frames.get(stream_id)
+    if broadcaster is None:
+        broadcaster = stream_frames[stream_id] = FrameBroadcaster()
+    return broadcaster
+
+
+async def publish_stream_frame(stream_id, img_bytes):
+    """
+    Hand a camera frame to the stream's viewers
+
+    The JPEG from the camera is passed through untouched, so viewers never
+    wait on decoding or analysis.
+    """
+    now = time.time()
+    stream = active_streams.get(stream_id)
+    if stream is None:
+        stream = active_streams[stream_id] = {"analysis": None}
+        heapq.heappush(expiry_heap, (now + STREAM_TIMEOUT_SECONDS, stream_id))
+    stream["last_frame"] = now
+
+    # Wake up everyone watching this stream. The multipart part is built
+    # once here rather than once per viewer
+    await get_frame_broadcaster(stream_id).publish(mjpeg_part(img_bytes))
+
+
+def store_stream_analysis(stream_id, analysis):
+    """Record the latest analysis results for a stream"""
+    stream = active_streams.get(stream_id)
+    if stream is not None:
+        stream["analysis"] = analysis
+
+
+def evict_idle_streams(now):
+    """
+    Drop streams whose last frame is older than STREAM_TIMEOUT_SECONDS
+
+    Only entries whose deadline has passed are looked at. A stream that
+    sent frames since its entry was pushed goes back on the heap with its
+    new deadline, so each stream keeps exactly one entry.
+    """
+    while expiry_heap and expiry_heap[0][0] <= now:
+        _, stream_id = heapq.heappop(expiry_heap)
+        stream = active_streams.get(stream_id)
+        if stream is None:
+            continue
+
+        deadline = stream["last_frame"] + STREAM_TIMEOUT_SECONDS
+        if deadline > now:
+            heapq.heappush(expiry_heap, (deadline, stream_id))
+            continue
+
+        del active_streams[stream_id]
+        frame_buffers.pop(stream_id, None)
+
+        # Anyone still watching keeps the broadcaster until they disconnect
+        broadcaster = stream_frames.get(stream_id)
+        if broadcaster is not None and not broadcaster.viewers:
+            del stream_frames[stream_id]
+
+    # The analysis worker may have decoded a frame for a stream evicted
+    # while it was queued, so sweep any buffers left for dead streams
+    for stream_id in list(frame_buffers):
+        if stream_id not in active_streams:
+            frame_buffers.pop(stream_id, None)
+
+
+async def expire_idle_streams():
+    """Periodically evict idle streams so stale IDs don't pile up"""
+    while True:
+        await asyncio.sleep(STREAM_JANITOR_INTERVAL_SECONDS)
+        evict_idle_streams(time.time())
+
+
+def is_valid_jpeg(img_bytes):
+    """Check the JPEG markers and header without decoding the image"""
+    if not img_bytes.startswith(b"\xff\xd8") or not img_bytes.endswith(b"\xff\xd9"):
+        return False
+
+    try:
+        jpeg_decoder.decode_header(img_bytes)
+    except Exception:
+        return False
+    return True
+
+
+def decode_frame(stream_id, img_bytes):
+    """
+    Decode a JPEG frame straight into a BGR numpy array with libjpeg-turbo
+
+    Frames are decoded into the stream's reusable buffer when the decoder
+    supports it. Only the analysis worker decodes frames, and it is done
+    with a stream's frame before decoding that stream's next one.
+    """
+    if not DECODE_INTO_BUFFER:
+        return jpeg_decoder.decode(img_bytes, pixel_format=TJPF_BGR)
+
+    width, height, _, _ = jpeg_decoder.decode_header(img_bytes)
+    buffer = frame_buffers.get(stream_id)
+    if buffer is None or buffer.shape[:2] != (height, width):
+        buffer = frame_buffers[stream_id] = np.empty((height, width, 3), np.uint8)
+
+    return jpeg_decoder.decode(img_bytes, pixel_format=TJPF_BGR, dst=buffer)
+
+
+def submit_stream_analysis(stream_id, img_bytes):
+    """
+    Queue a frame for background analysis
+
+    A frame still waiting from the same stream is replaced, so a fast camera
+    can never back up the worker and results always reflect the newest frame.
+    """
+    with analysis_ready:
+        pending_analysis[stream_id] = img_bytes
+        analysis_ready.notify()
+
+
+def next_analysis_batch():
+    """
+    Wait for frames to analyze
+
+    Once the first frame arrives, frames from other streams are collected
+    for up to ANALYSIS_BATCH_WINDOW_SECONDS, or until every active stream
+    has a frame waiting or the batch is full. Since only the newest frame
+    of each stream is kept, a single camera never waits for the window.
+
+    Returns:
+        list: (stream_id, img_bytes) pairs, empty when shutting down
+    """
+    with analysis_ready:
+        analysis_ready.wait_for(lambda: pending_analysis or analysis_stopping.is_set())
+
+        deadline = time.monotonic() + ANALYSIS_BATCH_WINDOW_SECONDS
+        while len(pending_analysis) < min(ANALYSIS_BATCH_SIZE, len(active_streams)):
+            remaining = deadline - time.monotonic()
+            if remaining <= 0 or analysis_stopping.is_set():
+                break
+            analysis_ready.wait(remaining)
+
+        if analysis_stopping.is_set():
+            return []
+
+        batch = list(pending_analysis.items())[:ANALYSIS_BATCH_SIZE]
+        for stream_id, _ in batch:
+            del pending_analysis[stream_id]
+
+    return batch
+
+
+def load_emotion_model():
+    """
+    Load the exported emotion model on the fastest available provider
+
+    Returns:
+        tuple: (onnxruntime session, OpenCV face detector), both None when
+            no model is configured
+    """
+    if not EMOTION_ONNX_MODEL:
+        return None, None
+
+    import cv2
+    import onnxruntime
+
+    available = onnxruntime.get_available_providers()
+    providers = [provider for provider in ONNX_PROVIDERS if provider in available]
+    session = onnxruntime.InferenceSession(EMOTION_ONNX_MODEL, providers=providers)
+
+    # Same Haar cascade DeepFace uses for its default "opencv" detector
+    detector = cv2.CascadeClassifier(
+        os.path.join(cv2.data.haarcascades, "haarcascade_frontalface_default.xml")
+    )
+    return session, detector
+
+
+def analysis_worker():
+    """Decode and analyze queued frames in batches until shutdown"""
+    global emotion_session, face_detector
+    try:
+        emotion_session, face_detector = load_emotion_model()
+    except Exception as e:
+        logger.error("Error loading emotion model: %s", e)
+
+    while not analysis_stopping.is_set():
+        stream_ids = []
+        frames = []
+        for stream_id, img_bytes in next_analysis_batch():
+            # Skip frames from streams that expired while queued
+            if stream_id not in active_streams:
+                continue
+
+            try:
+                frames.append(decode_frame(stream_id, img_bytes))
+                stream_ids.append(stream_id)
+            except Exception as e:
+                logger.warning("Error processing frame: %s", e)
+
+        if not frames:
+            continue
+
+        try:
+            results = deepface_analyze_batch(frames)
+        except Exception as e:
+            logger.warning("Error processing frame: %s", e)
+            continue
+
+        for stream_id, analysis in zip(stream_ids, results):
+            store_stream_analysis(stream_id, analysis)
+
+
+def stop_analysis_worker():
+    analysis_stopping.set()
+    with analysis_ready:
+        analysis_ready.notify_all()
+
+
+def deepface_analyze_batch(frames):
+    """
+    Analyze several frames in one pass
+
+    Args:
+        frames: List of numpy arrays representing images (BGR)
+
+    Returns:
+        list: Analysis results, one per frame
+    """
+    # The DeepFace placeholder works a frame at a time; the ONNX emotion
+    # model below scores the whole batch in a single run
+    results = [deepface_analyze(frame) for frame in frames]
+
+    if emotion_session is not None:
+        for result, scores in zip(results, predict_emotions(frames)):
+            # Frames without a detected face keep the placeholder emotions
+            if scores is not None:
+                result["emotion"] = dict(zip(EMOTION_LABELS, scores.tolist()))
+
+    return results
+
+
+def crop_face(frame):
+    """
+    Crop the largest face out of a frame, ready for the emotion model
+
+    Returns:
+        numpy.ndarray: 48x48 grayscale face, or None if no face was found
+    """
+    import cv2
+
+    gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+    faces = face_detector.detectMultiScale(gray, scaleFactor=1.1, minNeighbors=5)
+    if len(faces) == 0:
+        return None
+
+    x, y, w, h = max(faces, key=lambda face: face[2] * face[3])
+    return cv2.resize(
+        gray[y : y + h, x : x + w], EMOTION_INPUT_SIZE, interpolation=cv2.INTER_AREA
+    )
+
+
+def predict_emotions(frames):
+    """
+    Score emotions for a batch of frames with the exported ONNX model
+
+    Faces are cropped from every frame first, then all of them go through
+    the model in a single run.
+
+    Args:
+        frames: List of numpy arrays representing images (BGR)
+
+    Returns:
+        list: Emotion probabilities per frame, None where no face was found
+    """
+    faces = [crop_face(frame) for frame in frames]
+    found = [index for index, face in enumerate(faces) if face is not None]
+
+    scores = [None] * len(frames)
+    if not found:
+        return scores
 
-# Model for video stream data
-class VideoFrame(BaseModel):
-    stream_id: str
-    frame: str  # Base64 encoded image
-    timestamp: float
+    batch = np.stack([faces[index] for index in found]).astype(np.float32)
+    batch = batch[..., np.newaxis] / 255.0
+
+    input_name = emotion_session.get_inputs()[0].name
+    for index, row in zip(found, emotion_session.run(None, {input_name: batch})[0]):
+        scores[index] = row
+    return scores
 
 
 # DeepFace placeholder function
@@ -133,7 +606,7 @@ def deepface_analyze(frame):
     This will be replaced with actual DeepFace implementation later
 
     Args:
-        frame: Numpy array representing an image
+        frame: Numpy array representing an image (BGR)
 
     Returns:
         dict: Analysis results
@@ -148,8 +621,35 @@ def deepface_analyze(frame):
     }
 
 
+def _encode_white_jpeg(width, height):
+    """Encode a solid white JPEG of the given size"""
+    buffer = io.BytesIO()
+    Image.new("RGB", (width, height), "white").save(buffer, format="JPEG")
+    return buffer.getvalue()
+
+
+# Constant pieces of every MJPEG part
+_PART_A = b"--frame\r\nContent-Type: image/jpeg\r\nContent-Length: "
+_PART_B = b"\r\n\r\n"
+
+
+def mjpeg_part(jpeg):
+    """Wrap a JPEG in a multipart/x-mixed-replace part"""
+    return b"".join((_PART_A, str(len(jpeg)).encode(), _PART_B, jpeg, b"\r\n"))
+
+
+# Mark MJPEG responses as uncompressed so GZipMiddleware passes each part
+# straight through instead of buffering it
+MJPEG_HEADERS = {"Content-Encoding": "identity"}
+
+
+# Placeholder shown to viewers until a stream sends its first frame
+BLANK_JPEG = _encode_white_jpeg(640, 480)
+BLANK_FRAME_PART = mjpeg_part(BLANK_JPEG)
+
+
 # Stream frame generator for video streaming endpoint
-def stream_frames_generator(stream_id):
+async def stream_frames_generator(stream_id):
     """
     Generator for streaming frames
 
@@ -159,38 +659,38 @@ def stream_frames_generator(stream_id):
     Yields:
         bytes: JPEG frame data for streaming
     """
-    if stream_id not in stream_frames:
-        stream_frames[stream_id] = deque(maxlen=30)  # Store last 30 frames
-
-    # Serve a blank frame if no frames are available
-    if len(stream_frames[stream_id]) == 0:
-        blank_frame = np.ones((480, 640, 3), dtype=np.uint8) * 255
-        img = Image.fromarray(blank_frame.astype("uint8"))
-        buffer = io.BytesIO()
-        img.save(buffer, format="JPEG")
-        buffer.seek(0)
-        yield b"--frame\r\nContent-Type: image/jpeg\r\n\r\n" + buffer.read() + b"\r\n"
+    broadcaster = get_frame_broadcaster(stream_id)
+    broadcaster.viewers += 1
 
-    last_frame_time = 0
-    min_frame_interval = 1.0 / 15  # Max 15 FPS for streaming
+    try:
+        # Serve a blank frame if no frames are available
+        if broadcaster.latest_frame is None:
+            yield BLANK_FRAME_PART
+
+        frame_number = 0
+        while True:
+            # Sleep until the producer publishes a frame, waking up now and
+            # then to resend the last one so idle viewers stay connected
+            frame_number = await broadcaster.wait_for_frame(
+                frame_number, STREAM_KEEPALIVE_SECONDS
+            )
 
-    while True:
-        with stream_lock:
-            if len(stream_frames[stream_id]) == 0:
-                # If no frames available, wait a bit
-                time.sleep(0.1)
+            frame_part = broadcaster.latest_frame
+            if frame_part is None:
                 continue
 
-            # Get the latest frame
-            frame_data = stream_frames[stream_id][-1]
+            # Frames are published already wrapped as MJPEG parts
+            yield frame_part
+    finally:
+        broadcaster.viewers -= 1
 
-        current_time = time.time()
-        if current_time - last_frame_time < min_frame_interval:
-            time.sleep(min_frame_interval - (current_time - last_frame_time))
-
-        # Yield the frame in MJPEG format
-        yield b"--frame\r\nContent-Type: image/jpeg\r\n\r\n" + frame_data + b"\r\n"
-        last_frame_time = time.time()
+        # Forget broadcasters of streams that expired while being watched
+        if (
+            not broadcaster.viewers
+            and stream_id not in active_streams
+            and stream_frames.get(stream_id) is broadcaster
+        ):
+            del stream_frames[stream_id]
 
 
 def dict_factory(cursor, row):
@@ -201,79 +701,143 @@ def dict_factory(cursor, row):
     return d
 
 
-def get_db_connection():
-    """Create a connection to the SQLite database"""
-    conn = sqlite3.connect(DB_PATH)
-    conn.row_factory = dict_factory
-    return conn
+# Pragmas applied to every pooled connection
+SQLITE_PRAGMAS = (
+    "PRAGMA journal_mode=WAL",
+    "PRAGMA synchronous=NORMAL",
+    "PRAGMA temp_store=memory",
+    "PRAGMA cache_size=-64000",
+    "PRAGMA mmap_size=268435456",
+)
 
 
-def init_db():
-    """Initialize the database with required tables"""
-    conn = get_db_connection()
-    cursor = conn.cursor()
-
-    # Create users table
-    cursor.execute("""
-    CREATE TABLE IF NOT EXISTS users (
-        id TEXT PRIMARY KEY,
-        name TEXT NOT NULL,
-        email TEXT UNIQUE NOT NULL,
-        hashed_password TEXT NOT NULL,
-        image TEXT,
-        roast_count INTEGER DEFAULT 0,
-        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-    )
-    """)
-
-    # Create index on email for faster login
-    cursor.execute("CREATE INDEX IF NOT EXISTS idx_users_email ON users(email)")
-
-    # Create roast_configs table
-    cursor.execute("""
-    CREATE TABLE IF NOT EXISTS roast_configs (
-        user_id TEXT NOT NULL,
-        target_user_id TEXT NOT NULL,
-        topics TEXT NOT NULL,
-        style TEXT NOT NULL,
-        PRIMARY KEY (user_id, target_user_id),
-        FOREIGN KEY (user_id) REFERENCES users(id),
-        FOREIGN KEY (target_user_id) REFERENCES users(id)
-    )
-    """)
-
-    # Create indices for faster roast config queries
-    cursor.execute(
-        "CREATE INDEX IF NOT EXISTS idx_roast_configs_user_id ON roast_configs(user_id)"
-    )
-    cursor.execute(
-        "CREATE INDEX IF NOT EXISTS idx_roast_configs_target_user_id ON roast_configs(target_user_id)"
-    )
+class ConnectionPool:
+    """
+    Small pool of reusable SQLite connections
 
-    # Create roast history table
-    cursor.execute("""
-    CREATE TABLE IF NOT EXISTS roast_history (
-        id TEXT PRIMARY KEY,
-        target_user_id TEXT NOT NULL,
-        name TEXT NOT NULL,
-        characteristics TEXT NOT NULL,
-        roast_text TEXT NOT NULL,
-        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-        FOREIGN KEY (target_user_id) REFERENCES users(id)
-    )
-    """)
+    Connections are opened lazily up to `size` and handed back to the pool
+    when the caller is done, so requests don't pay for a fresh connect.
+    """
 
-    # Create index for roast history
-    cursor.execute(
-        "CREATE INDEX IF NOT EXISTS idx_roast_history_target_user_id ON roast_history(target_user_id)"
-    )
+    def __init__(self, db_path, size=8):
+        self.db_path = db_path
+        self.size = size
+        self._idle = queue.Queue(maxsize=size)
+        self._created = 0
+        self._lock = threading.Lock()
+
+    def _create_connection(self):
+        conn = sqlite3.connect(self.db_path, check_same_thread=False)
+        conn.row_factory = dict_factory
+        for pragma in SQLITE_PRAGMAS:
+            conn.execute(pragma)
+        return conn
+
+    def _get(self):
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            pass
+
+        with self._lock:
+            if self._created < self.size:
+                self._created += 1
+                create = True
+            else:
+                create = False
+
+        if create:
+            try:
+                return self._create_connection()
+            except Exception:
+                with self._lock:
+                    self._created -= 1
+                raise
+
+        # Pool is exhausted, wait for a connection to be returned
+        return self._idle.get()
+
+    @contextmanager
+    def acquire(self):
+        """Borrow a connection, returning it to the pool afterwards"""
+        conn = self._get()
+        try:
+            yield conn
+        finally:
+            # Never hand out a connection with a half-finished transaction
+            if conn.in_transaction:
+                conn.rollback()
+            self._idle.put(conn)
+
+
+db_pool = ConnectionPool(DB_PATH, size=DB_POOL_SIZE)
+
+
+# Bump whenever SCHEMA_SQL changes so existing databases pick it up
+SCHEMA_VERSION = 1
+
+SCHEMA_SQL = f"""
+BEGIN IMMEDIATE;
+
+-- Users
+CREATE TABLE IF NOT EXISTS users (
+    id TEXT PRIMARY KEY,
+    name TEXT NOT NULL,
+    email TEXT UNIQUE NOT NULL,
+    hashed_password TEXT NOT NULL,
+    image TEXT,
+    roast_count INTEGER DEFAULT 0,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+-- Index on email for faster login
+CREATE INDEX IF NOT EXISTS idx_users_email ON users(email);
+
+-- Roast configs
+CREATE TABLE IF NOT EXISTS roast_configs (
+    user_id TEXT NOT NULL,
+    target_user_id TEXT NOT NULL,
+    topics TEXT NOT NULL,
+    style TEXT NOT NULL,
+    PRIMARY KEY (user_id, target_user_id),
+    FOREIGN KEY (user_id) REFERENCES users(id),
+    FOREIGN KEY (target_user_id) REFERENCES users(id)
+);
+
+-- Lookups by user_id are already covered by the primary key
+DROP INDEX IF EXISTS idx_roast_configs_user_id;
+CREATE INDEX IF NOT EXISTS idx_roast_configs_target_user_id ON roast_configs(target_user_id);
+
+-- Roast history
+CREATE TABLE IF NOT EXISTS roast_history (
+    id TEXT PRIMARY KEY,
+    target_user_id TEXT NOT NULL,
+    name TEXT NOT NULL,
+    characteristics TEXT NOT NULL,
+    roast_text TEXT NOT NULL,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    FOREIGN KEY (target_user_id) REFERENCES users(id)
+);
+
+-- Ordered to match the history query
+DROP INDEX IF EXISTS idx_roast_history_target_user_id;
+CREATE INDEX IF NOT EXISTS idx_roast_history_target_created ON roast_history(target_user_id, created_at DESC);
+
+PRAGMA user_version = {SCHEMA_VERSION};
+
+COMMIT;
+"""
 
-    conn.commit()
-    conn.close()
 
+def init_db():
+    """Initialize the database with required tables"""
+    with db_pool.acquire() as conn:
+        # Skip the DDL if another worker already brought the schema up to date
+        version = conn.execute("PRAGMA user_version").fetchone()["user_version"]
+        if version >= SCHEMA_VERSION:
+            return
 
-# Initialize database
-init_db()
+        conn.executescript(SCHEMA_SQL)
 
 
 # Models
@@ -299,10 +863,6 @@ class Token(BaseModel):
     token_type: str
 
 
-class TokenData(BaseModel):
-    user_id: Optional[str] = None
-
-
 class UserPublic(BaseModel):
     id: str
     name: str
@@ -341,7 +901,14 @@ class TtsFormat(BaseModel):
 
 # Helper functions
 def verify_password(plain_password, hashed_password):
-    return pwd_context.verify(plain_password, hashed_password)
+    """
+    Check a password against its hash
+
+    Returns:
+        tuple: Whether it matched, and a replacement hash if the stored one
+        uses outdated settings
+    """
+    return pwd_context.verify_and_update(plain_password, hashed_password)
 
 
 def get_password_hash(password):
@@ -359,25 +926,204 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     return encoded_jwt
 
 
+def build_roast_messages(name: str, characteristics: List[str]):
+    """Build the chat messages asking Perplexity to roast someone"""
+    prompt = ROAST_PROMPT_TEMPLATE.format(
+        name=name,
+        characteristics="\n".join(f"- {c}" for c in characteristics),
+    )
+    return [ROAST_SYSTEM_MESSAGE, {"role": "user", "content": prompt}]
+
+
+def get_roast_characteristics(user_id: str) -> Optional[List[str]]:
+    """
+    Get the distinct topics from every roast config targeting a user
+
+    Topics are flattened and deduplicated by SQLite in first-seen order and
+    limited to ROAST_CHARACTERISTIC_COUNT.
+
+    Returns:
+        list: Topics, or None if nobody has configured a roast for the user
+    """
+    with db_pool.acquire() as conn:
+        cursor = conn.cursor()
+        cursor.execute(
+            """
+            SELECT topic
+            FROM (
+                SELECT je.value AS topic,
+                       ROW_NUMBER() OVER (ORDER BY r.rowid, je.key) AS position
+                FROM roast_configs r, json_each(r.topics) je
+                WHERE r.target_user_id = ?
+            )
+            GROUP BY topic
+            ORDER BY MIN(position)
+            LIMIT ?
+            """,
+            (user_id, ROAST_CHARACTERISTIC_COUNT),
+        )
+        characteristics = [row["topic"] for row in cursor.fetchall()]
+
+        if not characteristics:
+            # Configs with empty topic lists still count as configured
+            cursor.execute(
+                "SELECT 1 FROM roast_configs WHERE target_user_id = ? LIMIT 1",
+                (user_id,),
+            )
+            if cursor.fetchone() is None:
+                return None
+
+    return characteristics
+
+
+def save_roast_history(
+    roast_id: str, user_id: str, name: str, characteristics_json: str, roast_text: str
+):
+    """Store a generated roast and bump the target user's roast count"""
+    with db_pool.acquire() as conn, conn:
+        cursor = conn.cursor()
+        cursor.execute(
+            """
+            INSERT INTO roast_history (id, target_user_id, name, characteristics, roast_text)
+            VALUES (?, ?, ?, ?, ?)
+            """,
+            (roast_id, user_id, name, characteristics_json, roast_text),
+        )
+
+        # Update the roast count for the user
+        cursor.execute(
+            """
+            UPDATE users
+            SET roast_count = roast_count + 1
+            WHERE id = ?
+            """,
+            (user_id,),
+        )
+
+
+class SpeechStream:
+    """
+    TTS audio whose first chunk has already been fetched
+
+    Iterating yields the first chunk and then the rest of the upstream
+    stream. Closing it releases the ElevenLabs connection, whether or not
+    iteration ever started.
+    """
+
+    def __init__(self, audio_stream, first_chunk):
+        self.audio_stream = audio_stream
+        self.first_chunk = first_chunk
+
+    def __aiter__(self):
+        return self._chunks()
+
+    async def _chunks(self):
+        try:
+            yield self.first_chunk
+            async for chunk in self.audio_stream:
+                yield chunk
+        finally:
+            await self.aclose()
+
+    async def aclose(self):
+        await self.audio_stream.aclose()
+
+
+async def stream_speech(text: str, voice_id: str, output_format: str):
+    """
+    Start an ElevenLabs TTS stream
+
+    The first chunk is fetched up front so upstream errors surface before
+    a response has been started.
+
+    Returns:
+        SpeechStream: Audio chunks as they are synthesized
+    """
+    audio_stream = elevenlabs_client.text_to_speech.stream(
+        text=text,
+        voice_id=voice_id,
+        model_id="eleven_multilingual_v2",
+        output_format=output_format,
+    )
+    try:
+        first_chunk = await anext(audio_stream)
+    except StopAsyncIteration:
+        first_chunk = b""
+
+    return SpeechStream(audio_stream, first_chunk)
+
+
+def save_profile_image(upload: UploadFile, path: str):
+    """Shrink an uploaded profile image and save it to disk as a JPEG"""
+    upload.file.seek(0)
+    with Image.open(upload.file) as img:
+        # Let libjpeg decode JPEGs at a reduced scale, and shrink before
+        # converting, so the full-size photo is never held as RGB
+        img.draft("RGB", PROFILE_IMAGE_MAX_SIZE)
+        img = ImageOps.exif_transpose(img)
+        img.thumbnail(PROFILE_IMAGE_MAX_SIZE)
+        img = img.convert("RGB")
+        img.save(path, format="JPEG", quality=82, optimize=True, progressive=True)
+
+
+def decode_access_token(token: str) -> Optional[str]:
+    """
+    Get the user id from an access token
+
+    Verified tokens are remembered until they expire so repeat requests
+    from the same session skip the signature check.
+    """
+    user_id = verified_tokens.get(token)
+    if user_id is not None:
+        return user_id
+
+    payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+    user_id = payload.get("sub")
+    expires_at = payload.get("exp")
+    if user_id is not None and expires_at is not None:
+        verified_tokens.set(token, user_id, expires_at)
+
+    return user_id
+
+
 def get_user_by_email(email: str) -> Optional[Dict[str, Any]]:
     """Get user by email from the database"""
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    cursor.execute("SELECT * FROM users WHERE email = ?", (email,))
-    user = cursor.fetchone()
-    conn.close()
+    with db_pool.acquire() as conn:
+        cursor = conn.cursor()
+        cursor.execute("SELECT * FROM users WHERE email = ?", (email,))
+        user = cursor.fetchone()
     return user
 
 
 def get_user_by_id(user_id: str):
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    cursor.execute("SELECT * FROM users WHERE id = ?", (user_id,))
-    user = cursor.fetchone()
-    conn.close()
+    with db_pool.acquire() as conn:
+        cursor = conn.cursor()
+        cursor.execute("SELECT * FROM users WHERE id = ?", (user_id,))
+        user = cursor.fetchone()
+    return user
+
+
+def get_cached_user(user_id: str):
+    """
+    Get a user by id, reusing lookups from the last USER_CACHE_TTL_SECONDS
+
+    Call invalidate_cached_user() after changing a user's row.
+    """
+    user = cached_users.get(user_id)
+    if user is not None:
+        return user
+
+    user = get_user_by_id(user_id)
+    if user:
+        cached_users.set(user_id, user, time.time() + USER_CACHE_TTL_SECONDS)
+
     return user
 
 
+def invalidate_cached_user(user_id: str):
+    cached_users.pop(user_id)
+
+
 async def get_current_user(token: str = Depends(oauth2_scheme)):
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
@@ -385,15 +1131,13 @@ async def get_current_user(token: str = Depends(oauth2_scheme)):
         headers={"WWW-Authenticate": "Bearer"},
     )
     try:
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-        user_id: str = payload.get("sub")
-        if user_id is None:
-            raise credentials_exception
-        token_data = TokenData(user_id=user_id)
+        user_id = decode_access_token(token)
     except JWTError:
         raise credentials_exception
+    if user_id is None:
+        raise credentials_exception
 
-    user = get_user_by_id(token_data.user_id)
+    user = get_cached_user(user_id)
     if not user:
         raise credentials_exception
 
@@ -412,27 +1156,27 @@ async def register(user_data: UserCreate):
 
     # Create new user
     user_id = str(uuid.uuid4())
-    hashed_password = get_password_hash(user_data.password)
+    # bcrypt is deliberately slow, keep it off the event loop
+    hashed_password = await asyncio.to_thread(get_password_hash, user_data.password)
 
     # Insert user into database
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    cursor.execute(
-        """
-        INSERT INTO users (id, name, email, hashed_password, image, roast_count)
-        VALUES (?, ?, ?, ?, ?, ?)
-        """,
-        (
-            user_id,
-            user_data.name,
-            user_data.email,
-            hashed_password,
-            "/placeholder.svg?height=100&width=100",  # Default image
-            0,
-        ),
-    )
-    conn.commit()
-    conn.close()
+    with db_pool.acquire() as conn:
+        cursor = conn.cursor()
+        cursor.execute(
+            """
+            INSERT INTO users (id, name, email, hashed_password, image, roast_count)
+            VALUES (?, ?, ?, ?, ?, ?)
+            """,
+            (
+                user_id,
+                user_data.name,
+                user_data.email,
+                hashed_password,
+                "/placeholder.svg?height=100&width=100",  # Default image
+                0,
+            ),
+        )
+        conn.commit()
 
     return {"id": user_id, "name": user_data.name, "email": user_data.email}
 
@@ -450,13 +1194,27 @@ async def login(user_data: dict = Body(...)):
 
     user = get_user_by_email(email)
 
-    if not user or not verify_password(password, user["hashed_password"]):
+    # Always run bcrypt so unknown emails can't be told apart by timing
+    hashed_password = user["hashed_password"] if user else DUMMY_HASH
+    password_valid, new_hash = await asyncio.to_thread(
+        verify_password, password, hashed_password
+    )
+
+    if not user or not password_valid:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Incorrect email or password",
             headers={"WWW-Authenticate": "Bearer"},
         )
 
+    if new_hash:
+        # Upgrade hashes created with outdated settings
+        with db_pool.acquire() as conn, conn:
+            conn.execute(
+                "UPDATE users SET hashed_password = ? WHERE id = ?",
+                (new_hash, user["id"]),
+            )
+
     access_token_expires = timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
     access_token = create_access_token(
         data={"sub": user["id"]}, expires_delta=access_token_expires
@@ -477,18 +1235,17 @@ async def get_current_user_info(current_user: dict = Depends(get_current_user)):
 @app.get("/users", response_model=List[UserPublic])
 async def get_all_users(current_user: dict = Depends(get_current_user)):
     # Return all users except the current user
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    cursor.execute(
-        """
-        SELECT id, name, image, roast_count
-        FROM users
-        WHERE id != ?
-        """,
-        (current_user["id"],),
-    )
-    all_users = cursor.fetchall()
-    conn.close()
+    with db_pool.acquire() as conn:
+        cursor = conn.cursor()
+        cursor.execute(
+            """
+            SELECT id, name, image, roast_count
+            FROM users
+            WHERE id != ?
+            """,
+            (current_user["id"],),
+        )
+        all_users = cursor.fetchall()
 
     return all_users
 
@@ -509,19 +1266,18 @@ async def update_roast_config(
         )
 
     # Update or insert roast config
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    topics_json = json.dumps(config.topics)
+    with db_pool.acquire() as conn:
+        cursor = conn.cursor()
+        topics_json = orjson.dumps(config.topics).decode()
 
-    cursor.execute(
-        """
-        INSERT OR REPLACE INTO roast_configs (user_id, target_user_id, topics, style)
-        VALUES (?, ?, ?, ?)
-        """,
-        (user_id, target_user_id, topics_json, config.style),
-    )
-    conn.commit()
-    conn.close()
+        cursor.execute(
+            """
+            INSERT OR REPLACE INTO roast_configs (user_id, target_user_id, topics, style)
+            VALUES (?, ?, ?, ?)
+            """,
+            (user_id, target_user_id, topics_json, config.style),
+        )
+        conn.commit()
 
     return config
 
@@ -540,24 +1296,23 @@ async def get_roast_config(
         )
 
     # Get roast config from database
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    cursor.execute(
-        """
-        SELECT topics, style
-        FROM roast_configs
-        WHERE user_id = ? AND target_user_id = ?
-        """,
-        (user_id, target_user_id),
-    )
-    config = cursor.fetchone()
-    conn.close()
+    with db_pool.acquire() as conn:
+        cursor = conn.cursor()
+        cursor.execute(
+            """
+            SELECT topics, style
+            FROM roast_configs
+            WHERE user_id = ? AND target_user_id = ?
+            """,
+            (user_id, target_user_id),
+        )
+        config = cursor.fetchone()
 
     if not config:
         return {"topics": [], "style": "Funny but not too mean"}
 
     # Parse topics back from JSON
-    topics = json.loads(config["topics"])
+    topics = orjson.loads(config["topics"])
     return {"topics": topics, "style": config["style"]}
 
 
@@ -576,34 +1331,30 @@ async def roast_user(
             status_code=status.HTTP_404_NOT_FOUND, detail="User not found"
         )
 
-    # Update roast config
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    topics_json = json.dumps(config.topics)
-
-    cursor.execute(
-        """
-        INSERT OR REPLACE INTO roast_configs (user_id, target_user_id, topics, style)
-        VALUES (?, ?, ?, ?)
-        """,
-        (user_id, target_user_id, topics_json, config.style),
-    )
-
-    # Increment roast count
-    cursor.execute(
-        """
-        UPDATE users
-        SET roast_count = roast_count + 1
-        WHERE id = ?
-        """,
-        (target_user_id,),
-    )
+    # Update roast config and bump the roast count in a single transaction
+    topics_json = orjson.dumps(config.topics).decode()
 
-    cursor.execute("SELECT roast_count FROM users WHERE id = ?", (target_user_id,))
-    new_count = cursor.fetchone()["roast_count"]
+    with db_pool.acquire() as conn, conn:
+        cursor = conn.cursor()
+        cursor.execute(
+            """
+            INSERT OR REPLACE INTO roast_configs (user_id, target_user_id, topics, style)
+            VALUES (?, ?, ?, ?)
+            """,
+            (user_id, target_user_id, topics_json, config.style),
+        )
 
-    conn.commit()
-    conn.close()
+        # Increment roast count and read it back in the same statement
+        cursor.execute(
+            """
+            UPDATE users
+            SET roast_count = roast_count + 1
+            WHERE id = ?
+            RETURNING roast_count
+            """,
+            (target_user_id,),
+        )
+        new_count = cursor.fetchone()["roast_count"]
 
     return {"success": True, "roast_count": new_count}
 
@@ -620,24 +1371,23 @@ async def get_all_user_roasts(
         )
 
     # Get all roast configs for this user from the database
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    cursor.execute(
-        """
-        SELECT r.user_id, u.name as user_name, r.topics, r.style
-        FROM roast_configs r
-        JOIN users u ON r.user_id = u.id
-        WHERE r.target_user_id = ?
-        """,
-        (target_user_id,),
-    )
-    configs = cursor.fetchall()
-    conn.close()
+    with db_pool.acquire() as conn:
+        cursor = conn.cursor()
+        cursor.execute(
+            """
+            SELECT r.user_id, u.name as user_name, r.topics, r.style
+            FROM roast_configs r
+            JOIN users u ON r.user_id = u.id
+            WHERE r.target_user_id = ?
+            """,
+            (target_user_id,),
+        )
+        configs = cursor.fetchall()
 
     # Format the results
     all_roasts = []
     for config in configs:
-        topics = json.loads(config["topics"])
+        topics = orjson.loads(config["topics"])
         all_roasts.append(
             {
                 "user_id": config["user_id"],
@@ -652,47 +1402,49 @@ async def get_all_user_roasts(
 
 @app.post("/users/me/profile-image")
 async def update_profile_image(
-    image_data: str = Body(..., embed=True),
+    file: UploadFile = File(...),
     current_user: dict = Depends(get_current_user),
 ):
     user_id = current_user["id"]
 
-    # Decode base64 image
-    try:
-        # Remove the data:image/jpeg;base64, part if present
-        if "base64," in image_data:
-            image_data = image_data.split("base64,")[1]
-
-        image_bytes = base64.b64decode(image_data)
-    except Exception as e:
+    if not (file.content_type or "").startswith("image/"):
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
-            detail=f"Invalid image data: {str(e)}",
+            detail="Invalid image data: expected an image upload",
         )
 
     # Save image file
     image_filename = f"{user_id}_profile.jpg"
     image_path = os.path.join(UPLOADS_DIR, image_filename)
 
-    with open(image_path, "wb") as f:
-        f.write(image_bytes)
+    try:
+        await asyncio.to_thread(save_profile_image, file, image_path)
+    except (OSError, Image.DecompressionBombError) as e:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Invalid image data: {str(e)}",
+        )
 
-    # Update user record with image URL - use absolute URL
+    # Update user record with image URL - use absolute URL. Every upload
+    # reuses the same file name, so version the URL with the file's mtime
+    # to keep browsers from showing a cached old image
     image_rel_path = f"/uploads/{image_filename}"
-    image_url = f"{BASE_URL}{image_rel_path}"
+    image_version = os.stat(image_path).st_mtime_ns
+    image_url = f"{BASE_URL}{image_rel_path}?v={image_version}"
 
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    cursor.execute(
-        """
-        UPDATE users
-        SET image = ?
-        WHERE id = ?
-        """,
-        (image_url, user_id),
-    )
-    conn.commit()
-    conn.close()
+    with db_pool.acquire() as conn:
+        cursor = conn.cursor()
+        cursor.execute(
+            """
+            UPDATE users
+            SET image = ?
+            WHERE id = ?
+            """,
+            (image_url, user_id),
+        )
+        conn.commit()
+
+    invalidate_cached_user(user_id)
 
     return {"image_url": image_url}
 
@@ -704,30 +1456,30 @@ async def update_user_profile(
     user_id = current_user["id"]
 
     # Update user fields in database
-    conn = get_db_connection()
-    cursor = conn.cursor()
+    with db_pool.acquire() as conn:
+        cursor = conn.cursor()
 
-    updates = []
-    values = []
+        updates = []
+        values = []
 
-    if "name" in profile_data:
-        updates.append("name = ?")
-        values.append(profile_data["name"])
+        if "name" in profile_data:
+            updates.append("name = ?")
+            values.append(profile_data["name"])
 
-    if "email" in profile_data:
-        updates.append("email = ?")
-        values.append(profile_data["email"])
+        if "email" in profile_data:
+            updates.append("email = ?")
+            values.append(profile_data["email"])
 
-    if updates:
-        query = f"UPDATE users SET {', '.join(updates)} WHERE id = ?"
-        values.append(user_id)
-        cursor.execute(query, values)
-        conn.commit()
+        if updates:
+            query = f"UPDATE users SET {', '.join(updates)} WHERE id = ?"
+            values.append(user_id)
+            cursor.execute(query, values)
+            conn.commit()
+            invalidate_cached_user(user_id)
 
-    # Get updated user data
-    cursor.execute("SELECT id, name, email FROM users WHERE id = ?", (user_id,))
-    updated_user = cursor.fetchone()
-    conn.close()
+        # Get updated user data
+        cursor.execute("SELECT id, name, email FROM users WHERE id = ?", (user_id,))
+        updated_user = cursor.fetchone()
 
     return updated_user
 
@@ -741,68 +1493,23 @@ async def generate_roast(user_id: str, request: RoastRequest):
             status_code=status.HTTP_404_NOT_FOUND, detail="User not found"
         )
 
-    # Get all roast configurations for this user
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    cursor.execute(
-        """
-        SELECT r.topics, r.style
-        FROM roast_configs r
-        WHERE r.target_user_id = ?
-        """,
-        (user_id,),
-    )
-    roast_configs = cursor.fetchall()
-    conn.close()
-
-    if not roast_configs:
+    # Combine the topics from all roast configurations for this user
+    characteristics = get_roast_characteristics(user_id)
+    if characteristics is None:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail="No roast configurations found for this user",
         )
 
-    # Combine all topics from different roast configs
-    all_topics = []
-    for config in roast_configs:
-        topics = json.loads(config["topics"])
-        all_topics.extend(topics)
-
-    # Remove duplicates while preserving order
-    characteristics = []
-    for topic in all_topics:
-        if topic not in characteristics:
-            characteristics.append(topic)
-
-    # Limit to 5 characteristics if we have more
-    if len(characteristics) > 5:
-        characteristics = characteristics[:5]
-
-    # Fill in if we have less than 5
-    while len(characteristics) < 5:
-        characteristics.append("generic")
+    # Fill in if we have too few
+    characteristics += ["generic"] * (ROAST_CHARACTERISTIC_COUNT - len(characteristics))
 
     # Create the prompt
-    prompt = f"""You are the roast god, a vulgar, vial roaster who can be clever but also blunt and cruel. You're not afraid to be politically incorrect and use all the characteristics and context at your disposal. You will be given a name and a list of characteristics and generate a paragraph long roast about them. There is one key detail: RETURN THE ROAST AND NOTHING BUT THE ROAST. There should be no other text besides this one paragraph roasting whoever it is. Now give it a shot:
-
-NAME: {request.name} 
-CHARACTERISTICS:
-- {characteristics[0]}
-- {characteristics[1]} 
-- {characteristics[2]}
-- {characteristics[3]}
-- {characteristics[4]}"""
+    messages = build_roast_messages(request.name, characteristics)
 
     # Call Perplexity API
     try:
-        messages = [
-            {
-                "role": "system",
-                "content": "You are a roast bot that generates clever, funny roasts.",
-            },
-            {"role": "user", "content": prompt},
-        ]
-
-        response = perplexity_client.chat.completions.create(
+        response = await perplexity_client.chat.completions.create(
             model="sonar-small-chat",  # Using a smaller model for cost efficiency
             messages=messages,
         )
@@ -811,31 +1518,12 @@ CHARACTERISTICS:
 
         # Save this roast to history
         roast_id = str(uuid.uuid4())
-        characteristics_json = json.dumps(characteristics)
-
-        conn = get_db_connection()
-        cursor = conn.cursor()
-        cursor.execute(
-            """
-            INSERT INTO roast_history (id, target_user_id, name, characteristics, roast_text)
-            VALUES (?, ?, ?, ?, ?)
-            """,
-            (roast_id, user_id, request.name, characteristics_json, roast_text),
-        )
+        characteristics_json = orjson.dumps(characteristics).decode()
 
-        # Update the roast count for the user
-        cursor.execute(
-            """
-            UPDATE users
-            SET roast_count = roast_count + 1
-            WHERE id = ?
-            """,
-            (user_id,),
+        save_roast_history(
+            roast_id, user_id, request.name, characteristics_json, roast_text
         )
 
-        conn.commit()
-        conn.close()
-
         return {"roast": roast_text, "roast_id": roast_id}
 
     except Exception as e:
@@ -857,25 +1545,24 @@ async def get_roast_history(
         )
 
     # Get roast history for this user
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    cursor.execute(
-        """
-        SELECT id, name, characteristics, roast_text, created_at
-        FROM roast_history
-        WHERE target_user_id = ?
-        ORDER BY created_at DESC
-        LIMIT 50
-        """,
-        (user_id,),
-    )
-    history_items = cursor.fetchall()
-    conn.close()
+    with db_pool.acquire() as conn:
+        cursor = conn.cursor()
+        cursor.execute(
+            """
+            SELECT id, name, characteristics, roast_text, created_at
+            FROM roast_history
+            WHERE target_user_id = ?
+            ORDER BY created_at DESC
+            LIMIT 50
+            """,
+            (user_id,),
+        )
+        history_items = cursor.fetchall()
 
     # Format the response
     formatted_history = []
     for item in history_items:
-        characteristics = json.loads(item["characteristics"])
+        characteristics = orjson.loads(item["characteristics"])
         formatted_history.append(
             {
                 "id": item["id"],
@@ -889,9 +1576,16 @@ async def get_roast_history(
     return formatted_history
 
 
+def is_valid_raspi_api_key(api_key):
+    """Compare an API key against RASPI_API_KEY in constant time"""
+    return api_key is not None and hmac.compare_digest(
+        api_key.encode(), RASPI_API_KEY_B
+    )
+
+
 # API Key verification function
 async def verify_raspi_api_key(x_api_key: str = Header(None)):
-    if x_api_key != RASPI_API_KEY:
+    if not is_valid_raspi_api_key(x_api_key):
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid API Key"
         )
@@ -916,7 +1610,7 @@ async def trigger_roast_from_raspi(
     Optional query parameter:
     - format: Audio format (mp3, pcm) - defaults to mp3
 
-    Returns audio data of the roast spoken by ElevenLabs TTS
+    Streams audio data of the roast spoken by ElevenLabs TTS
     """
     user_id = request.get("user_id")
     name = request.get("name")
@@ -939,68 +1633,23 @@ async def trigger_roast_from_raspi(
             status_code=status.HTTP_404_NOT_FOUND, detail="User not found"
         )
 
-    # Get all roast configurations for this user
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    cursor.execute(
-        """
-        SELECT r.topics, r.style
-        FROM roast_configs r
-        WHERE r.target_user_id = ?
-        """,
-        (user_id,),
-    )
-    roast_configs = cursor.fetchall()
-    conn.close()
-
-    if not roast_configs:
+    # Combine the topics from all roast configurations for this user
+    characteristics = get_roast_characteristics(user_id)
+    if characteristics is None:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail="No roast configurations found for this user",
         )
 
-    # Combine all topics from different roast configs
-    all_topics = []
-    for config in roast_configs:
-        topics = json.loads(config["topics"])
-        all_topics.extend(topics)
-
-    # Remove duplicates while preserving order
-    characteristics = []
-    for topic in all_topics:
-        if topic not in characteristics:
-            characteristics.append(topic)
-
-    # Limit to 5 characteristics if we have more
-    if len(characteristics) > 5:
-        characteristics = characteristics[:5]
-
-    # Fill in if we have less than 5
-    while len(characteristics) < 5:
-        characteristics.append("generic")
+    # Fill in if we have too few
+    characteristics += ["generic"] * (ROAST_CHARACTERISTIC_COUNT - len(characteristics))
 
     # Create the prompt
-    prompt = f"""You are the roast god, a vulgar, vial roaster who can be clever but also blunt and cruel. You're not afraid to be politically incorrect and use all the characteristics and context at your disposal. You will be given a name and a list of characteristics and generate a paragraph long roast about them. There is one key detail: RETURN THE ROAST AND NOTHING BUT THE ROAST. There should be no other text besides this one paragraph roasting whoever it is. Now give it a shot:
-
-NAME: {name} 
-CHARACTERISTICS:
-- {characteristics[0]}
-- {characteristics[1]} 
-- {characteristics[2]}
-- {characteristics[3]}
-- {characteristics[4]}"""
+    messages = build_roast_messages(name, characteristics)
 
     # Call Perplexity API to generate the roast
     try:
-        messages = [
-            {
-                "role": "system",
-                "content": "You are a roast bot that generates clever, funny roasts.",
-            },
-            {"role": "user", "content": prompt},
-        ]
-
-        response = perplexity_client.chat.completions.create(
+        response = await perplexity_client.chat.completions.create(
             model="sonar-small-chat",  # Using a smaller model for cost efficiency
             messages=messages,
         )
@@ -1009,62 +1658,53 @@ CHARACTERISTICS:
 
         # Save this roast to history
         roast_id = str(uuid.uuid4())
-        characteristics_json = json.dumps(characteristics)
-
-        conn = get_db_connection()
-        cursor = conn.cursor()
-        cursor.execute(
-            """
-            INSERT INTO roast_history (id, target_user_id, name, characteristics, roast_text)
-            VALUES (?, ?, ?, ?, ?)
-            """,
-            (roast_id, user_id, name, characteristics_json, roast_text),
+        characteristics_json = orjson.dumps(characteristics).decode()
+
+        output_format = "mp3_44100_128" if audio_format == "mp3" else "pcm_24000"
+
+        # Write the history row while ElevenLabs starts streaming the speech
+        history_result, audio_stream = await asyncio.gather(
+            asyncio.to_thread(
+                save_roast_history,
+                roast_id,
+                user_id,
+                name,
+                characteristics_json,
+                roast_text,
+            ),
+            stream_speech(roast_text, voice_id, output_format),
+            return_exceptions=True,
         )
 
-        # Update the roast count for the user
-        cursor.execute(
-            """
-            UPDATE users
-            SET roast_count = roast_count + 1
-            WHERE id = ?
-            """,
-            (user_id,),
-        )
-
-        conn.commit()
-        conn.close()
-
-        # Convert text to speech using ElevenLabs
-        try:
-            output_format = "mp3_44100_128" if audio_format == "mp3" else "pcm_24000"
-
-            audio_data = elevenlabs_client.text_to_speech.convert(
-                text=roast_text,
-                voice_id=voice_id,
-                model_id="eleven_multilingual_v2",
-                output_format=output_format,
-            )
-
-            # Return audio data with appropriate content type
-            content_type = "audio/mpeg" if audio_format == "mp3" else "audio/pcm"
-
-            return Response(
-                content=audio_data,
-                media_type=content_type,
-                headers={
-                    "Content-Disposition": f"attachment; filename=roast_{roast_id}.{audio_format}"
-                },
-            )
+        if isinstance(history_result, Exception):
+            # Release the ElevenLabs connection before giving up on the roast
+            if not isinstance(audio_stream, Exception):
+                await audio_stream.aclose()
+            raise history_result
 
-        except Exception as e:
+        if isinstance(audio_stream, Exception):
             # If TTS fails, fall back to returning the text
-            print(f"TTS generation failed: {str(e)}")
+            logger.warning("TTS generation failed: %s", audio_stream)
             return {
                 "roast": roast_text,
                 "roast_id": roast_id,
                 "error": "TTS generation failed, returning text only",
             }
 
+        # Stream audio data with appropriate content type
+        content_type = "audio/mpeg" if audio_format == "mp3" else "audio/pcm"
+
+        return StreamingResponse(
+            audio_stream,
+            media_type=content_type,
+            headers={
+                "Content-Disposition": f"attachment; filename=roast_{roast_id}.{audio_format}",
+                # Keep GZipMiddleware from buffering the stream; MP3 doesn't
+                # compress anyway
+                "Content-Encoding": "identity",
+            },
+        )
+
     except Exception as e:
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
@@ -1073,58 +1713,56 @@ CHARACTERISTICS:
 
 
 # API endpoints for video streaming
-@app.post("/api/raspi/stream-frame")
-async def receive_stream_frame(
-    frame_data: VideoFrame, api_key: str = Depends(verify_raspi_api_key)
-):
+async def ingest_frame(stream_id: str, frame: UploadFile):
     """
-    Endpoint for Raspberry Pi to send video frames
-
-    Args:
-        frame_data: VideoFrame model with stream_id, frame data, and timestamp
-        api_key: API key for authentication
+    Read an uploaded camera frame, publish it to viewers and queue it for
+    analysis
 
     Returns:
         dict: Status response
     """
-    stream_id = frame_data.stream_id
-
-    # Decode the base64 image
     try:
-        img_bytes = base64.b64decode(frame_data.frame)
+        # Read the frame data
+        img_bytes = await frame.read()
+    except Exception as e:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Invalid image data: {str(e)}",
+        )
 
-        # Process with DeepFace (placeholder for now)
-        # In a production system, this would be done in a separate worker thread/process
-        try:
-            # Convert bytes to image for analysis
-            img = Image.open(io.BytesIO(img_bytes))
-            frame_array = np.array(img)
+    # Never hand viewers or the analysis worker something that isn't a JPEG
+    if not is_valid_jpeg(img_bytes):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Invalid image data: not a JPEG",
+        )
 
-            # Analyze with DeepFace (placeholder)
-            analysis = deepface_analyze(frame_array)
+    await publish_stream_frame(stream_id, img_bytes)
 
-            # Store the active stream information
-            with stream_lock:
-                active_streams[stream_id] = {
-                    "last_frame": time.time(),
-                    "analysis": analysis,
-                }
+    # Analyze with DeepFace (placeholder) in the background
+    submit_stream_analysis(stream_id, img_bytes)
 
-                # Add frame to the stream's frame queue
-                if stream_id not in stream_frames:
-                    stream_frames[stream_id] = deque(maxlen=30)  # Store last 30 frames
-                stream_frames[stream_id].append(img_bytes)
+    return {"status": "received", "analysis": "queued"}
 
-        except Exception as e:
-            print(f"Error processing frame: {e}")
 
-    except Exception as e:
-        raise HTTPException(
-            status_code=status.HTTP_400_BAD_REQUEST,
-            detail=f"Invalid image data: {str(e)}",
-        )
+@app.post("/api/raspi/stream-frame", status_code=status.HTTP_202_ACCEPTED)
+async def receive_stream_frame(
+    stream_id: str = Form(...),
+    frame: UploadFile = File(...),
+    api_key: str = Depends(verify_raspi_api_key),
+):
+    """
+    Endpoint for Raspberry Pi to send video frames
 
-    return {"status": "received"}
+    Args:
+        stream_id: Identifier for the camera/stream
+        frame: JPEG frame uploaded as multipart binary
+        api_key: API key for authentication
+
+    Returns:
+        dict: Status response
+    """
+    return await ingest_frame(stream_id, frame)
 
 
 @app.get("/api/streams")
@@ -1138,14 +1776,14 @@ async def list_active_streams(current_user: dict = Depends(get_current_user)):
     result = {}
     current_time = time.time()
 
-    with stream_lock:
-        for stream_id, stream_data in active_streams.items():
-            # Consider a stream active if it received a frame in the last 30 seconds
-            if current_time - stream_data["last_frame"] < 30:
-                result[stream_id] = {
-                    "last_frame": stream_data["last_frame"],
-                    "active_since": current_time - stream_data["last_frame"],
-                }
+    # Idle streams are evicted by the janitor; this only hides the few that
+    # timed out since its last pass
+    for stream_id, stream_data in active_streams.items():
+        if current_time - stream_data["last_frame"] < STREAM_TIMEOUT_SECONDS:
+            result[stream_id] = {
+                "last_frame": stream_data["last_frame"],
+                "active_since": current_time - stream_data["last_frame"],
+            }
 
     return result
 
@@ -1187,6 +1825,7 @@ async def get_video_stream(
     return StreamingResponse(
         stream_frames_generator(stream_id),
         media_type="multipart/x-mixed-replace; boundary=frame",
+        headers=MJPEG_HEADERS,
     )
 
 
@@ -1204,7 +1843,7 @@ async def get_public_video_stream(stream_id: str, api_key: str):
     Returns:
         StreamingResponse: MJPEG video stream
     """
-    if api_key != RASPI_API_KEY:
+    if not is_valid_raspi_api_key(api_key):
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid API Key"
         )
@@ -1212,10 +1851,11 @@ async def get_public_video_stream(stream_id: str, api_key: str):
     return StreamingResponse(
         stream_frames_generator(stream_id),
         media_type="multipart/x-mixed-replace; boundary=frame",
+        headers=MJPEG_HEADERS,
     )
 
 
-@app.post("/api/raspi/upload_frame")
+@app.post("/api/raspi/upload_frame", status_code=status.HTTP_202_ACCEPTED)
 async def upload_frame(stream_id: str = Form(...), frame: UploadFile = File(...)):
     """
     Endpoint for Raspberry Pi to upload video frames directly from PiCamera
@@ -1227,42 +1867,7 @@ async def upload_frame(stream_id: str = Form(...), frame: UploadFile = File(...)
     Returns:
         dict: Status response
     """
-    try:
-        # Read the frame data
-        img_bytes = await frame.read()
-
-        # Process with DeepFace (placeholder for now)
-        try:
-            # Convert bytes to image for analysis
-            img = Image.open(io.BytesIO(img_bytes))
-            frame_array = np.array(img)
-
-            # Analyze with DeepFace (placeholder)
-            analysis = deepface_analyze(frame_array)
-
-            # Store the active stream information
-            with stream_lock:
-                active_streams[stream_id] = {
-                    "last_frame": time.time(),
-                    "analysis": analysis,
-                }
-
-                # Add frame to the stream's frame queue
-                if stream_id not in stream_frames:
-                    stream_frames[stream_id] = deque(maxlen=30)  # Store last 30 frames
-                stream_frames[stream_id].append(img_bytes)
-
-            return {"status": "received", "analysis": "success"}
-
-        except Exception as e:
-            print(f"Error processing frame: {e}")
-            return {"status": "received", "analysis": "failed", "error": str(e)}
-
-    except Exception as e:
-        raise HTTPException(
-            status_code=status.HTTP_400_BAD_REQUEST,
-            detail=f"Invalid image data: {str(e)}",
-        )
+    return await ingest_frame(stream_id, frame)
 
 
 # Root endpoint for testing
@@ -1274,4 +1879,7 @@ async def root():
 if __name__ == "__main__":
     import uvicorn
 
+    # uvicorn picks up uvloop and httptools when they are installed. Keep a
+    # single worker: stream frames and the auth caches live in this process,
+    # so a second worker would never see frames posted to the first
     uvicorn.run(app, host="0.0.0.0", port=8000)
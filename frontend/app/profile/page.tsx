@@ -90,33 +90,17 @@ export default function ProfilePage() {
 
     setIsUploadingImage(true)
     try {
-      // Convert image to base64
-      const reader = new FileReader()
-      
-      reader.onload = async (event) => {
-        if (event.target?.result) {
-          const base64Image = event.target.result as string
-          
-          // Upload image to server
-          const response = await uploadProfileImage(base64Image)
-          
-          // Update local state with new image URL from server
-          setProfileImage(response.image_url)
-          
-          showFeedback("Profile image updated successfully", false)
-        }
-        setIsUploadingImage(false)
-      }
-      
-      reader.onerror = () => {
-        showFeedback("Failed to read image file", true)
-        setIsUploadingImage(false)
-      }
-      
-      reader.readAsDataURL(file)
+      // Upload image to server
+      const response = await uploadProfileImage(file)
+
+      // Update local state with new image URL from server
+      setProfileImage(response.image_url)
+
+      showFeedback("Profile image updated successfully", false)
     } catch (error) {
       console.error("Error uploading image:", error)
       showFeedback("Failed to upload image", true)
+    } finally {
       setIsUploadingImage(false)
     }
   }
@@ -9,7 +9,8 @@ export async function fetchWithAuth(url: string, options: RequestInit = {}) {
   const token = localStorage.getItem("token")
 
   const headers = {
-    "Content-Type": "application/json",
+    // Let the browser set the multipart boundary for FormData bodies
+    ...(options.body instanceof FormData ? {} : { "Content-Type": "application/json" }),
     ...(token ? { Authorization: `Bearer ${token}` } : {}),
     ...options.headers,
   }
@@ -217,10 +218,13 @@ export async function updateUserProfile(profileData: any) {
   return response.json()
 }
 
-export async function uploadProfileImage(imageData: string) {
+export async function uploadProfileImage(image: Blob) {
+  const formData = new FormData()
+  formData.append("file", image)
+
   const response = await fetchWithAuth("/users/me/profile-image", {
     method: "POST",
-    body: JSON.stringify({ image_data: imageData }),
+    body: formData,
   })
 
   if (!response.ok) {
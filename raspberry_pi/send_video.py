@@ -1,64 +1,181 @@
-import io
+import logging
+import logging.handlers
 import os
+import queue
 import requests
+import simplejpeg
+import threading
 import time
 from picamera2 import Picamera2
+from requests.adapters import HTTPAdapter
 
 # === CONFIGURATION ===
 SERVER_IP = "192.168.86.137"  # Replace with your actual server IP
 SERVER_PORT = "8000"         # Replace if your server uses a different port
 STREAM_URL = f"http://{SERVER_IP}:{SERVER_PORT}/api/raspi/upload_frame"
-
-print(f"Streaming video to {STREAM_URL}")
-
-# Initialize the camera
-picam2 = Picamera2()
-picam2.configure(picam2.create_video_configuration(main={"size": (640, 480)}))
-picam2.start()
-
-# Give the camera time to warm up
-print("Warming up camera...")
-time.sleep(2)
-
-# Use a BytesIO stream to hold the image data
-stream = io.BytesIO()
-
-try:
-    print("Starting video stream. Press Ctrl+C to stop.")
-
+JPEG_QUALITY = 70            # Best baseline 4:2:0 JPEG quality sent to the server
+MIN_JPEG_QUALITY = 40        # Lowest quality used while the server is slow
+FPS = 10                     # Best frame rate sent to the server
+MIN_FPS = 3                  # Lowest frame rate used while the server is slow
+SLOW_RTT = 0.2               # Back off when uploads average longer than this (seconds)
+FAST_RTT = 0.08              # Ramp back up once uploads average under this...
+RAMP_UP_AFTER = 5.0          # ...for this many seconds
+VERBOSE = os.getenv("VERBOSE") == "1"  # Log every frame sent
+
+# Log through a queue so the capture and sender threads never block on the terminal
+log_queue = queue.SimpleQueue()
+logging.basicConfig(
+    level=logging.DEBUG if VERBOSE else logging.INFO,
+    format="%(asctime)s %(levelname)s %(message)s",
+    handlers=[logging.handlers.QueueHandler(log_queue)]
+)
+log_listener = logging.handlers.QueueListener(log_queue, logging.StreamHandler())
+log_listener.start()
+logger = logging.getLogger(__name__)
+
+logger.info("Streaming video to %s", STREAM_URL)
+
+# Reuse one keep-alive connection for every frame
+session = requests.Session()
+session.mount("http://", HTTPAdapter(pool_connections=1, pool_maxsize=1))
+
+# Frames waiting to be sent; the oldest is dropped when the network stalls
+frames = queue.Queue(maxsize=2)
+
+
+class RateController:
+    """
+    Adapts JPEG quality and frame rate to the upload round-trip time
+
+    The sender thread records how long each upload took. Once a second the
+    capture loop steps quality and frame rate down while the average is
+    slow, and back up after it has stayed fast for RAMP_UP_AFTER seconds.
+    """
+
+    def __init__(self):
+        self.quality = JPEG_QUALITY
+        self.fps = FPS
+        self.rtt = None
+        self.last_adjusted = time.monotonic()
+        self.fast_since = None
+
+    def record_rtt(self, rtt):
+        """Fold an upload round-trip time into the moving average"""
+        if self.rtt is None:
+            self.rtt = rtt
+        else:
+            self.rtt = 0.8 * self.rtt + 0.2 * rtt
+
+    def adjust(self, now):
+        """Step quality and frame rate according to the average round trip"""
+        if self.rtt is None or now - self.last_adjusted < 1.0:
+            return
+        self.last_adjusted = now
+
+        if self.rtt > SLOW_RTT:
+            self.quality = max(MIN_JPEG_QUALITY, self.quality - 5)
+            self.fps = max(MIN_FPS, self.fps - 1)
+            self.fast_since = None
+        elif self.rtt < FAST_RTT:
+            if self.fast_since is None:
+                self.fast_since = now
+            elif now - self.fast_since >= RAMP_UP_AFTER:
+                self.quality = min(JPEG_QUALITY, self.quality + 5)
+                self.fps = min(FPS, self.fps + 1)
+                self.fast_since = now
+        else:
+            self.fast_since = None
+
+
+rate = RateController()
+
+
+def queue_frame(frame):
+    """Queue a frame for sending, dropping the oldest one if the queue is full"""
     while True:
-        stream.seek(0)
-        stream.truncate()
+        try:
+            frames.put_nowait(frame)
+            return
+        except queue.Full:
+            try:
+                frames.get_nowait()
+            except queue.Empty:
+                pass
 
-        # Capture image to stream
-        picam2.capture_file(stream, format='jpeg')
 
-        # Reset stream position
-        stream.seek(0)
+def send_frames():
+    """Send queued frames to the server until a None frame is queued"""
+    while True:
+        frame = frames.get()
+        if frame is None:
+            break
 
+        started = time.monotonic()
         try:
-            response = requests.post(
+            response = session.post(
                 STREAM_URL,
-                files={'frame': ('image.jpg', stream.read(), 'image/jpeg')},
+                files={'frame': ('image.jpg', frame, 'image/jpeg')},
                 data={'stream_id': 'picamera'},
                 timeout=1.0
             )
 
-            if response.status_code == 200:
-                print(".", end="", flush=True)
-            else:
-                print(f"\nError: Server returned status code {response.status_code}")
+            rate.record_rtt(time.monotonic() - started)
+
+            if not response.ok:
+                logger.warning("Server returned status code %d", response.status_code)
+            elif logger.isEnabledFor(logging.DEBUG):
+                logger.debug(
+                    "Sent %d byte frame (quality %d, %d fps)",
+                    len(frame), rate.quality, rate.fps
+                )
 
         except requests.exceptions.RequestException as e:
-            print(f"\nRequest error: {e}")
+            logger.warning("Request error: %s", e)
+            rate.record_rtt(time.monotonic() - started)
             time.sleep(1)
 
-        time.sleep(0.1)  # Small delay to reduce network load
+
+sender = threading.Thread(target=send_frames, daemon=True)
+
+# Initialize the camera
+picam2 = Picamera2()
+picam2.configure(picam2.create_video_configuration(main={"size": (640, 480), "format": "XBGR8888"}))
+picam2.start()
+
+# Give the camera time to warm up
+logger.info("Warming up camera...")
+time.sleep(2)
+
+try:
+    logger.info("Starting video stream. Press Ctrl+C to stop.")
+    sender.start()
+
+    while True:
+        frame_started = time.monotonic()
+
+        # Capture raw pixels and encode them with libjpeg-turbo, which
+        # releases the GIL while the sender thread is posting
+        frame = picam2.capture_array("main")
+        queue_frame(simplejpeg.encode_jpeg(
+            frame,
+            quality=rate.quality,
+            colorspace='RGBX',
+            colorsubsampling='420'
+        ))
+
+        # Pace capture to the current frame rate
+        rate.adjust(frame_started)
+        time.sleep(max(0, 1 / rate.fps - (time.monotonic() - frame_started)))
 
 except KeyboardInterrupt:
-    print("\nStopping video stream...")
+    logger.info("Stopping video stream...")
 
 finally:
+    queue_frame(None)
+    if sender.is_alive():
+        sender.join(timeout=2)
     picam2.close()
-    print("Camera released. Stream ended.")
+    session.close()
+    logger.info("Camera released. Stream ended.")
+    log_listener.stop()
 